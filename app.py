@@ -6,7 +6,8 @@
 认证: Authorization=a7X2p9KmL1sD4fGh0Qz8bV6yW3nUo5Ir (自行修改随机Token)
 """
 
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, request, jsonify, redirect, g, has_request_context
+import click
 import string
 import random
 import re
@@ -15,7 +16,27 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 import time
-from urllib.parse import quote, unquote
+import hashlib
+import math
+import socket
+import atexit
+import mmap
+import struct
+import subprocess
+import json
+import glob
+import fcntl
+import bisect
+import heapq
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import timedelta
+from collections import OrderedDict, deque
+import cProfile
+import pstats
+import uuid
+from urllib.parse import quote, unquote, urlparse
 import base64
 import io
 import qrcode
@@ -25,6 +46,12 @@ from PIL import Image
 import pymysql
 import pymysql.cursors
 
+# 协程感知的剖析支持（gevent工作进程）
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
 # 缓存支持
 try:
     import redis
@@ -49,6 +76,20 @@ MYSQL_USER = os.getenv('MYSQL_USER', 'shortlink')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', 'shortlink123456')
 MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'shortlink')
 
+# MySQL分片配置（为空时只使用上面的单实例）
+MYSQL_SHARDS = os.getenv('MYSQL_SHARDS', '')  # 例如: db1:3306,db2:3306/shortlink
+MYSQL_SHARD_REBALANCING = os.getenv('MYSQL_SHARD_REBALANCING', 'false').lower() == 'true'  # 迁移期间查找回退
+SHARD_VIRTUAL_NODES = int(os.getenv('SHARD_VIRTUAL_NODES', '160'))  # 每个分片的虚拟节点数
+SHARD_LIST_MAX_OFFSET = int(os.getenv('SHARD_LIST_MAX_OFFSET', '10000'))  # 多分片时列表分页的最大偏移量
+
+# MySQL超时与熔断配置
+MYSQL_CONNECT_TIMEOUT = int(os.getenv('MYSQL_CONNECT_TIMEOUT', '2'))  # 连接超时（秒）
+MYSQL_READ_TIMEOUT = int(os.getenv('MYSQL_READ_TIMEOUT', '3'))  # 读超时（秒）
+MYSQL_WRITE_TIMEOUT = int(os.getenv('MYSQL_WRITE_TIMEOUT', '3'))  # 写超时（秒）
+MYSQL_MAINTENANCE_TIMEOUT = int(os.getenv('MYSQL_MAINTENANCE_TIMEOUT', '0'))  # 维护任务读写超时（秒），0表示不限
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # 连续失败多少次后熔断
+BREAKER_RESET_TIMEOUT = int(os.getenv('BREAKER_RESET_TIMEOUT', '10'))  # 熔断后多久放行探测请求（秒）
+
 # Redis配置
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
@@ -60,6 +101,43 @@ BASE_URL = os.getenv('BASE_URL', 'http://localhost:2282')
 SHORT_CODE_LENGTH = int(os.getenv('SHORT_CODE_LENGTH', '6'))
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 CACHE_TTL = int(os.getenv('CACHE_TTL', '3600'))  # 缓存过期时间（秒）
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', '10000'))  # 进程内链接缓存条数
+LOCAL_CACHE_TTL = int(os.getenv('LOCAL_CACHE_TTL', '60'))  # 进程内链接缓存过期时间（秒）
+SPOOL_DIR = os.getenv('SPOOL_DIR', '/app/data/spool')  # 数据库不可用时写操作暂存目录
+SPOOL_REPLAY_INTERVAL = int(os.getenv('SPOOL_REPLAY_INTERVAL', '5'))  # 查询成功后检查暂存队列的最短间隔（秒）
+
+# 性能诊断配置
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # 随机剖析的请求比例（0-1）
+PROFILE_HISTORY = int(os.getenv('PROFILE_HISTORY', '50'))  # 保留最近多少条剖析记录
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))  # 慢查询阈值（毫秒）
+SLOW_QUERY_HISTORY = int(os.getenv('SLOW_QUERY_HISTORY', '100'))  # 保留最近多少条慢查询
+
+# 重定向快照配置（供Nginx边缘层直接跳转）
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '/app/data/snapshot')  # 快照输出目录
+SNAPSHOT_CHANGELOG_RETENTION_DAYS = int(os.getenv('SNAPSHOT_CHANGELOG_RETENTION_DAYS', '7'))  # 变更日志保留天数
+SNAPSHOT_CHANGE_OVERLAP = int(os.getenv('SNAPSHOT_CHANGE_OVERLAP', '300'))  # 增量构建时重新读取上次构建前多少秒内的变更
+
+# 链接过期清理配置
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', '60'))  # 后台清理间隔（秒），0表示关闭
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', '500'))  # 每批清理的链接数
+SWEEP_MODE = os.getenv('SWEEP_MODE', 'delete')  # delete: 直接删除; archive: 移入links_archive
+SWEEP_LOCK_NAME = 'shortlink:expiry-sweeper'  # 多个工作进程间协调清理的MySQL命名锁
+
+# 点击写入方式配置
+CLICK_SINK = os.getenv('CLICK_SINK', 'mysql')  # mysql: 每次点击写入clicks表; segments: 追加到本地分段日志
+CLICK_LOG_DIR = os.getenv('CLICK_LOG_DIR', '/app/data/clicklog')  # 点击分段日志目录
+CLICK_SEGMENT_MAX_BYTES = int(os.getenv('CLICK_SEGMENT_MAX_BYTES', str(64*1024*1024)))  # 单个分段最大字节数
+CLICK_SEGMENT_MAX_AGE = int(os.getenv('CLICK_SEGMENT_MAX_AGE', '300'))  # 分段最长写入时间（秒），到期封存
+CLICK_FSYNC_BATCH = int(os.getenv('CLICK_FSYNC_BATCH', '256'))  # 每累计多少条记录fsync一次
+CLICK_FSYNC_INTERVAL_MS = int(os.getenv('CLICK_FSYNC_INTERVAL_MS', '200'))  # 最长多久fsync一次（毫秒）
+CLICK_STATS_WINDOW = int(os.getenv('CLICK_STATS_WINDOW', '3600'))  # 统计接口读取最近多少秒内创建的未导入分段
+
+# 统计草图配置（独立访客HyperLogLog + 来源/UA Top-K）
+SKETCH_TOP_K = int(os.getenv('SKETCH_TOP_K', '10'))  # 统计接口返回的Top-K条数
+SKETCH_CAPACITY = int(os.getenv('SKETCH_CAPACITY', '100'))  # 每日Top-K草图保留的计数器数
+SKETCH_RETENTION_DAYS = int(os.getenv('SKETCH_RETENTION_DAYS', '90'))  # 每日草图保留天数
+SKETCH_DEFAULT_DAYS = int(os.getenv('SKETCH_DEFAULT_DAYS', '30'))  # 统计接口默认查询天数
+SKETCH_MEMORY_MAX_BUCKETS = int(os.getenv('SKETCH_MEMORY_MAX_BUCKETS', '2000'))  # 无Redis时每个进程最多保留的按日草图数
 
 # 确保数据目录存在并设置权限
 data_dir = '/app/data'
@@ -109,39 +187,796 @@ def setup_logging():
     access_logger = logging.getLogger('access')
     access_logger.addHandler(access_handler)
     access_logger.setLevel(logging.INFO)
+
+    # 慢查询日志处理器
+    slow_query_handler = RotatingFileHandler(
+        '/app/logs/slow_query.log',
+        maxBytes=50*1024*1024,  # 50MB
+        backupCount=10
+    )
+    slow_query_handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(message)s'
+    ))
+    slow_query_logger = logging.getLogger('slow_query')
+    slow_query_logger.addHandler(slow_query_handler)
+    slow_query_logger.setLevel(logging.INFO)
     
     return access_logger
 
 access_logger = setup_logging()
+slow_query_logger = logging.getLogger('slow_query')
+
+# 概率统计草图
+class HyperLogLog:
+    """HyperLogLog基数估计（内存模式使用，可合并）"""
+
+    def __init__(self, precision=12):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        """添加元素"""
+        h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """合并另一个草图（取寄存器最大值）"""
+        for i, value in enumerate(other.registers):
+            if value > self.registers[i]:
+                self.registers[i] = value
+
+    def count(self):
+        """估计基数"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # 小基数使用线性计数修正
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Space-Saving Top-K计数草图（内存模式使用，可合并）"""
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, item, count=1):
+        """累加元素计数，满容量时替换最小计数器"""
+        if item in self.counters or len(self.counters) < self.capacity:
+            self.counters[item] = self.counters.get(item, 0) + count
+            return
+        victim = min(self.counters, key=self.counters.get)
+        floor = self.counters.pop(victim)
+        self.counters[item] = floor + count
+
+    def merge(self, other):
+        """合并另一个草图"""
+        for item, count in other.counters.items():
+            self.add(item, count)
+
+    def top(self, k):
+        """返回计数最高的k个元素"""
+        ranked = sorted(self.counters.items(), key=lambda kv: kv[1], reverse=True)
+        return [{"value": item, "count": int(count)} for item, count in ranked[:k]]
+
+
+# Redis端Space-Saving更新脚本：已存在则累加；未满则插入；已满则替换最小计数器
+SPACE_SAVING_LUA = '''
+local key = KEYS[1]
+local item = ARGV[1]
+local capacity = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+if redis.call('ZSCORE', key, item) then
+    redis.call('ZINCRBY', key, 1, item)
+elseif redis.call('ZCARD', key) < capacity then
+    redis.call('ZADD', key, 1, item)
+else
+    local popped = redis.call('ZPOPMIN', key)
+    redis.call('ZADD', key, tonumber(popped[2]) + 1, item)
+end
+redis.call('EXPIRE', key, ttl)
+return 1
+'''
+
+
+class LinkSketches:
+    """每个短链接的按日统计草图：独立访客、来源Top-K、UA Top-K
+
+    有Redis时使用PFADD/PFCOUNT和有序集合，多个工作进程共享；
+    否则退化为进程内存草图：只覆盖当前工作进程处理的点击，进程重启后丢失，
+    使用低精度HLL并按LRU限制草图数量，仅作尽力而为的参考。
+    按日分桶，查询时合并多日草图，查询代价只与天数和草图容量有关，与点击量无关。
+    """
+
+    KINDS = ('referers', 'user_agents')
+    KEY_KINDS = ('uv',) + KINDS
+    MEMORY_PRECISION = 10  # 1 KiB寄存器，标准误差约3.3%
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.ttl = SKETCH_RETENTION_DAYS * 86400
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._space_saving = cache.register_script(SPACE_SAVING_LUA) if cache else None
+
+    @staticmethod
+    def _day(when):
+        return when.strftime('%Y%m%d')
+
+    @staticmethod
+    def _referer_key(referer):
+        """来源按域名聚合，空来源记为直接访问"""
+        if not referer:
+            return '(direct)'
+        return urlparse(referer).netloc or referer[:200]
+
+    def _days(self, days):
+        today = datetime.now()
+        return [self._day(today - timedelta(days=i)) for i in range(days)]
+
+    def record(self, short_code, ip_address, user_agent, referer):
+        """记录一次点击"""
+        day = self._day(datetime.now())
+        visitor = ip_address or ''
+        values = {
+            'referers': self._referer_key(referer),
+            'user_agents': (user_agent or '(unknown)')[:200]
+        }
+
+        if self.cache:
+            pipe = self.cache.pipeline(transaction=False)
+            uv_key = f'sketch:uv:{short_code}:{day}'
+            pipe.pfadd(uv_key, visitor)
+            pipe.expire(uv_key, self.ttl)
+            for kind, value in values.items():
+                self._space_saving(
+                    keys=[f'sketch:{kind}:{short_code}:{day}'],
+                    args=[value, SKETCH_CAPACITY, self.ttl],
+                    client=pipe
+                )
+            pipe.execute()
+            return
+
+        with self._lock:
+            bucket = self._memory.get((short_code, day))
+            if bucket is None:
+                self._expire_memory()
+                bucket = {'uv': HyperLogLog(self.MEMORY_PRECISION)}
+                bucket.update({kind: SpaceSaving(SKETCH_TOP_K * 2) for kind in self.KINDS})
+                self._memory[(short_code, day)] = bucket
+                while len(self._memory) > SKETCH_MEMORY_MAX_BUCKETS:
+                    self._memory.popitem(last=False)
+            else:
+                self._memory.move_to_end((short_code, day))
+            bucket['uv'].add(visitor)
+            for kind, value in values.items():
+                bucket[kind].add(value)
+
+    def _expire_memory(self):
+        """清理超过保留期的内存草图"""
+        oldest = self._day(datetime.now() - timedelta(days=SKETCH_RETENTION_DAYS))
+        for key in [k for k in self._memory if k[1] < oldest]:
+            del self._memory[key]
+
+    def query(self, short_code, days=SKETCH_DEFAULT_DAYS, top_k=SKETCH_TOP_K):
+        """合并最近days天的草图并返回统计结果"""
+        day_list = self._days(days)
+        merged = {kind: SpaceSaving(SKETCH_CAPACITY * 2) for kind in self.KINDS}
+
+        if self.cache:
+            unique_visitors = self.cache.pfcount(*[f'sketch:uv:{short_code}:{d}' for d in day_list])
+            pipe = self.cache.pipeline(transaction=False)
+            for kind in self.KINDS:
+                for d in day_list:
+                    pipe.zrange(f'sketch:{kind}:{short_code}:{d}', 0, -1, withscores=True)
+            results = iter(pipe.execute())
+            for kind in self.KINDS:
+                for _ in day_list:
+                    for item, score in next(results):
+                        merged[kind].add(item, score)
+        else:
+            hll = HyperLogLog(self.MEMORY_PRECISION)
+            with self._lock:
+                for d in day_list:
+                    bucket = self._memory.get((short_code, d))
+                    if bucket is None:
+                        continue
+                    hll.merge(bucket['uv'])
+                    for kind in self.KINDS:
+                        merged[kind].merge(bucket[kind])
+            unique_visitors = hll.count()
+
+        return {
+            "days": days,
+            "scope": "cluster" if self.cache else "worker",
+            "unique_visitors": unique_visitors,
+            "top_referers": merged['referers'].top(top_k),
+            "top_user_agents": merged['user_agents'].top(top_k)
+        }
+
+    def delete(self, short_code=None):
+        """删除指定短链接（或全部）的草图"""
+        if short_code is not None:
+            self.delete_many([short_code])
+            return
+
+        if self.cache:
+            keys = list(self.cache.scan_iter(match='sketch:*', count=500))
+            for i in range(0, len(keys), 500):
+                self.cache.delete(*keys[i:i + 500])
+            return
+
+        with self._lock:
+            self._memory.clear()
+
+    def delete_many(self, short_codes):
+        """删除一批短链接的草图；键名确定，按保留期内的日期直接删除"""
+        if self.cache:
+            day_list = self._days(SKETCH_RETENTION_DAYS + 1)
+            pipe = self.cache.pipeline(transaction=False)
+            for short_code in short_codes:
+                pipe.delete(*[f'sketch:{kind}:{short_code}:{d}' for kind in self.KEY_KINDS for d in day_list])
+            pipe.execute()
+            return
+
+        codes = set(short_codes)
+        with self._lock:
+            for key in [k for k in self._memory if k[0] in codes]:
+                del self._memory[key]
+
+# 数据库不可用（熔断器打开或连接失败）
+class DatabaseUnavailable(Exception):
+    pass
+
+
+# 客户端连接类错误码：无法连接、连接断开、读写超时
+CONNECTION_ERROR_CODES = {
+    2003,  # CR_CONN_HOST_ERROR
+    2006,  # CR_SERVER_GONE_ERROR
+    2013,  # CR_SERVER_LOST
+    2055,  # CR_SERVER_LOST_EXTENDED
+}
+
+def is_connection_error(error):
+    """是否为连接类错误（计入熔断）；服务端返回的错误不算"""
+    if isinstance(error, (pymysql.err.InterfaceError, socket.timeout, ConnectionError)):
+        return True
+    if isinstance(error, pymysql.err.OperationalError):
+        return bool(error.args) and error.args[0] in CONNECTION_ERROR_CODES
+    return False
+
+
+class CircuitBreaker:
+    """数据库熔断器：连续失败达到阈值后打开，期间快速失败；
+    冷却时间过后放行一个探测请求（半开），成功则关闭"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许请求访问数据库"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """记录成功，返回是否从故障中恢复"""
+        with self._lock:
+            recovered = self.state != 'closed'
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+        if recovered:
+            app.logger.info(f'Circuit breaker for {self.name} closed')
+        return recovered
+
+    def record_failure(self):
+        """记录失败，达到阈值或探测失败时打开熔断器"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    app.logger.error(f'Circuit breaker for {self.name} opened after {self.failures} failures')
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+class LocalCache:
+    """进程内LRU缓存，过期条目保留用于数据库不可用时的降级读取"""
+
+    def __init__(self, max_size=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, allow_stale=False):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time() and not allow_stale:
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DurableSpool:
+    """本地持久化队列：数据库不可用时暂存写操作，恢复后按顺序重放
+
+    每条记录一行JSON，追加后立即fsync。多个工作进程共享同一个文件，
+    追加与重放通过文件锁互斥。
+    """
+
+    def __init__(self, directory=SPOOL_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'spool.jsonl')
+        self._append_lock_path = os.path.join(directory, 'append.lock')
+        self._replay_lock_path = os.path.join(directory, 'replay.lock')
+        self._lock = threading.Lock()
+
+    def append(self, kind, payload):
+        """追加一条待重放的操作"""
+        line = json.dumps({"kind": kind, "payload": payload, "queued_at": time.time()}, default=str)
+        with self._lock, open(self._append_lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending_bytes(self):
+        """待重放数据大小"""
+        total = 0
+        for path in glob.glob(os.path.join(self.directory, 'spool.jsonl*')):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def replay(self, handler):
+        """重放队列，直到没有新的追加；handler抛出DatabaseUnavailable时停止并保留剩余记录"""
+        with open(self._replay_lock_path, 'a') as replay_lock:
+            try:
+                fcntl.flock(replay_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # 其他工作进程正在重放
+
+            replayed = 0
+            while True:
+                # 将当前队列文件改名后重放，重放期间新的追加写入新文件，下一轮继续处理
+                with self._lock, open(self._append_lock_path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    if os.path.exists(self.path):
+                        os.rename(self.path, f'{self.path}.{int(time.time() * 1000)}.replay')
+
+                paths = sorted(glob.glob(f'{self.path}.*.replay'))
+                if not paths:
+                    return replayed
+                for path in paths:
+                    with open(path, encoding='utf-8') as f:
+                        lines = f.readlines()
+                    for index, line in enumerate(lines):
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            app.logger.error(f'Dropping corrupt spool entry: {line[:200]!r}')
+                            continue
+                        try:
+                            handler(entry['kind'], entry['payload'])
+                            replayed += 1
+                        except DatabaseUnavailable:
+                            # 数据库再次不可用：剩余记录写回该文件，下次继续
+                            with open(path, 'w', encoding='utf-8') as f:
+                                f.writelines(lines[index:])
+                                f.flush()
+                                os.fsync(f.fileno())
+                            return replayed
+                        except Exception as e:
+                            app.logger.error(f'Dropping spooled {entry["kind"]} {entry["payload"]}: {e}')
+                    os.remove(path)
+
+class RecentRecords:
+    """最近N条诊断记录（性能剖析、慢查询）；有Redis时跨工作进程共享"""
+
+    def __init__(self, cache, key, limit):
+        self.cache = cache
+        self.key = key
+        self.limit = limit
+        self._memory = deque(maxlen=limit)
+
+    def push(self, record):
+        if self.cache:
+            try:
+                pipe = self.cache.pipeline(transaction=False)
+                pipe.lpush(self.key, json.dumps(record, default=str))
+                pipe.ltrim(self.key, 0, self.limit - 1)
+                pipe.execute()
+                return
+            except Exception as e:
+                app.logger.warning(f'Failed to store {self.key} record in Redis: {e}')
+        self._memory.appendleft(record)
+
+    def list(self):
+        """按时间倒序返回全部记录"""
+        if self.cache:
+            try:
+                return [json.loads(item) for item in self.cache.lrange(self.key, 0, -1)]
+            except Exception as e:
+                app.logger.warning(f'Failed to read {self.key} records from Redis: {e}')
+        return list(self._memory)
+
+    def get(self, record_id):
+        for record in self.list():
+            if record.get('id') == record_id:
+                return record
+        return None
+
+
+def describe_params(params):
+    """描述参数结构（类型与长度），不记录参数值"""
+    def shape(value):
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}[{len(value)}]'
+        return type(value).__name__
+
+    if params is None:
+        return '()'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: {shape(v)}' for k, v in params.items()) + '}'
+    return '(' + ', '.join(shape(v) for v in params) + ')'
+
+# 点击分段日志：定长二进制记录追加写入本地分段文件，离线批量导入MySQL
+# 分段文件: 8字节头 + 若干定长记录（时间戳, 标志, short_code, IP, UA, Referer；字符串按字节截断并以NUL填充）
+CLICK_SEGMENT_HEADER = b'SLCLK\x01\x00\x00'
+CLICK_RECORD = struct.Struct('<dB50s45s256s256s')
+CLICK_CODE_SLICE = slice(9, 59)  # 记录中short_code字段的位置，用于快速过滤
+CLICK_FLAG_COUNTED = 1  # 点击计数已在MySQL中累加（设置了max_clicks的链接）
+
+
+class ClickSegmentLog:
+    """点击分段日志
+
+    每个工作进程写自己的活动分段（*.open），达到大小或时长上限后改名为*.seg。
+    每条记录直接写入页缓存，fsync按条数或时间间隔批量执行；没有新点击时由后台线程
+    按时fsync并封存到期的分段。
+    """
+
+    def __init__(self, directory=CLICK_LOG_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._pid = None
+        self._opened_at = 0
+        self._size = 0
+        self._pending = 0
+        self._last_fsync = 0
+        self._flusher_pid = None
+        atexit.register(self.close)
+
+    def _open_segment(self):
+        self._start_flusher()
+        self._pid = os.getpid()
+        self._opened_at = time.time()
+        self._path = os.path.join(self.directory, f'clicks-{int(self._opened_at * 1000)}-{self._pid}.open')
+        self._file = open(self._path, 'ab', buffering=0)
+        # 写入期间持有文件锁，导入程序据此判断分段是否仍在使用；进程退出时自动释放
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._file.write(CLICK_SEGMENT_HEADER)
+        self._size = len(CLICK_SEGMENT_HEADER)
+        self._last_fsync = self._opened_at
+
+    def _seal_segment(self):
+        """fsync并把活动分段改名为已封存分段；无论成功与否都放弃当前分段，下次写入时新建"""
+        if self._file is None:
+            return
+        try:
+            os.fsync(self._file.fileno())
+            # 持有文件锁时改名，导入程序不会同时封存它
+            os.rename(self._path, self._path[:-len('.open')] + '.seg')
+        except FileNotFoundError:
+            pass  # 已被封存
+        finally:
+            self._file.close()
+            self._file = None
+            self._path = None
+            self._pending = 0
+
+    def _start_flusher(self):
+        """每个进程启动一个后台线程（gevent下为协程），fork后在子进程中重新启动"""
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def worker():
+            interval = min(CLICK_FSYNC_INTERVAL_MS / 1000, CLICK_SEGMENT_MAX_AGE)
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush_idle()
+                except Exception as e:
+                    app.logger.warning(f'Click log flush failed: {e}')
+
+        threading.Thread(target=worker, daemon=True, name='click-log-flusher').start()
+
+    def flush_idle(self):
+        """没有新点击时也按CLICK_FSYNC_INTERVAL_MS执行fsync，并封存超过CLICK_SEGMENT_MAX_AGE的分段"""
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                return
+            now = time.time()
+            if now - self._opened_at >= CLICK_SEGMENT_MAX_AGE:
+                self._seal_segment()
+            elif self._pending and (now - self._last_fsync) * 1000 >= CLICK_FSYNC_INTERVAL_MS:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+                self._last_fsync = now
+
+    def append(self, short_code, ip_address, user_agent, referer, counted=False):
+        """追加一条点击记录"""
+        record = CLICK_RECORD.pack(
+            time.time(),
+            CLICK_FLAG_COUNTED if counted else 0,
+            short_code.encode('utf-8'),
+            (ip_address or '').encode('utf-8'),
+            (user_agent or '').encode('utf-8'),
+            (referer or '').encode('utf-8')
+        )
+        with self._lock:
+            if self._file is not None and self._pid != os.getpid():
+                self._file = None  # fork后不沿用父进程的分段
+            now = time.time()
+            if self._file is not None and (
+                    self._size >= CLICK_SEGMENT_MAX_BYTES or now - self._opened_at >= CLICK_SEGMENT_MAX_AGE):
+                self._seal_segment()
+            if self._file is None:
+                self._open_segment()
+
+            self._file.write(record)
+            self._size += len(record)
+            self._pending += 1
+            if self._pending >= CLICK_FSYNC_BATCH or (now - self._last_fsync) * 1000 >= CLICK_FSYNC_INTERVAL_MS:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+                self._last_fsync = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._seal_segment()
+
+    def segments(self, include_open=True):
+        """按创建时间排序的分段文件列表"""
+        patterns = ['*.seg', '*.open'] if include_open else ['*.seg']
+        paths = [p for pattern in patterns for p in glob.glob(os.path.join(self.directory, pattern))]
+        return sorted(paths, key=lambda p: os.path.basename(p).split('.')[0])
+
+    @staticmethod
+    def _segment_opened_at(path):
+        """从文件名 clicks-{创建毫秒}-{pid}.* 中解析分段创建时间"""
+        return int(os.path.basename(path).split('-')[1]) / 1000
+
+    def seal_stale_segments(self):
+        """封存工作进程退出或崩溃后遗留的活动分段
+
+        仍在写入的分段由所属进程持有文件锁，跳过，由该进程自己封存。
+        """
+        for path in glob.glob(os.path.join(self.directory, '*.open')):
+            try:
+                with open(path, 'rb') as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    os.rename(path, path[:-len('.open')] + '.seg')
+            except OSError:
+                pass
+
+    def recent_clicks(self, short_code, limit=100):
+        """读取最近CLICK_STATS_WINDOW秒内创建的未导入分段：返回 (最近点击列表, 未计入click_count的点击数)
+
+        更早的分段不扫描，其中的点击在导入MySQL之前不会出现在统计中。
+        """
+        key = short_code.encode('utf-8').ljust(CLICK_CODE_SLICE.stop - CLICK_CODE_SLICE.start, b'\0')
+        cutoff = time.time() - CLICK_STATS_WINDOW
+        clicks = []
+        uncounted = 0
+        for path in self.segments():
+            try:
+                opened_at = self._segment_opened_at(path)
+            except (IndexError, ValueError):
+                continue
+            # 分段内的记录都写于创建后CLICK_SEGMENT_MAX_AGE秒内
+            if opened_at + CLICK_SEGMENT_MAX_AGE < cutoff:
+                continue
+            for record in iter_click_segment(path, key):
+                if not record['flags'] & CLICK_FLAG_COUNTED:
+                    uncounted += 1
+                clicks.append(record)
+        clicks.sort(key=lambda r: r['clicked_at'], reverse=True)
+        return clicks[:limit], uncounted
+
+
+def iter_click_segment(path, code_key=None):
+    """用mmap遍历分段中的完整记录；code_key不为空时只返回该short_code的记录"""
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(CLICK_SEGMENT_HEADER):
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(CLICK_SEGMENT_HEADER)] != CLICK_SEGMENT_HEADER:
+                    app.logger.warning(f'Skipping invalid click segment {path}')
+                    return
+                # 末尾不完整的记录（写入中或崩溃）忽略
+                for offset in range(len(CLICK_SEGMENT_HEADER), size - CLICK_RECORD.size + 1, CLICK_RECORD.size):
+                    if code_key is not None and \
+                            mm[offset + CLICK_CODE_SLICE.start:offset + CLICK_CODE_SLICE.stop] != code_key:
+                        continue
+                    ts, flags, code, ip, ua, ref = CLICK_RECORD.unpack_from(mm, offset)
+                    yield {
+                        "short_code": code.rstrip(b'\0').decode('utf-8', 'ignore'),
+                        "flags": flags,
+                        "ip_address": ip.rstrip(b'\0').decode('utf-8', 'ignore'),
+                        "user_agent": ua.rstrip(b'\0').decode('utf-8', 'ignore'),
+                        "referer": ref.rstrip(b'\0').decode('utf-8', 'ignore'),
+                        "clicked_at": datetime.fromtimestamp(ts).replace(microsecond=0)
+                    }
+    except FileNotFoundError:
+        return  # 分段已被导入程序删除
+
+def log_link_changes(cursor, short_codes, operation):
+    """在调用方的事务中记录链接变更（upsert/delete/clear），供重定向快照增量构建使用"""
+    if not short_codes:
+        return
+    cursor.execute(
+        "INSERT INTO link_changes (short_code, operation) VALUES " + ', '.join(['(%s, %s)'] * len(short_codes)),
+        tuple(value for code in short_codes for value in (code, operation))
+    )
+
+# 一致性哈希环
+class ConsistentHashRing:
+    """按short_code将链接映射到分片，新增分片时只迁移约1/N的数据"""
+
+    def __init__(self, nodes, virtual_nodes=SHARD_VIRTUAL_NODES):
+        self._ring = []
+        for index, node in enumerate(nodes):
+            for replica in range(virtual_nodes):
+                self._ring.append((self._hash(f'{node}#{replica}'), index))
+        self._ring.sort()
+        self._hashes = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key):
+        """返回key所属分片的下标"""
+        position = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[position][1]
+
+
+def parse_shards(spec):
+    """解析分片配置: host:port[/database],host:port[/database],..."""
+    shards = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        address, _, database = item.partition('/')
+        host, _, port = address.partition(':')
+        shards.append({
+            'host': host,
+            'port': int(port or MYSQL_PORT),
+            'database': database or MYSQL_DATABASE
+        })
+    return shards
 
 # MySQL数据库管理器
 class DatabaseManager:
     def __init__(self):
         self.db_type = 'mysql'
         self.pool = None
+        self._local = threading.local()
         self.cache = None
+        self.sketches = None
+        self.local_cache = LocalCache()
+        self.spool = DurableSpool()
+        self.click_log = ClickSegmentLog()
         self._init_mysql()
         self._init_cache()
+        self.sketches = LinkSketches(self.cache)
+        self.profiles = RecentRecords(self.cache, 'diag:profiles', PROFILE_HISTORY)
+        self.slow_queries = RecentRecords(self.cache, 'diag:slow_queries', SLOW_QUERY_HISTORY)
+        self._last_replay_check = 0
 
     def _init_mysql(self):
-        """初始化MySQL连接配置"""
+        """初始化MySQL连接配置（支持多分片）"""
         try:
-            self.config = {
+            shards = parse_shards(MYSQL_SHARDS) or [{
                 'host': MYSQL_HOST,
                 'port': MYSQL_PORT,
-                'user': MYSQL_USER,
-                'password': MYSQL_PASSWORD,
-                'database': MYSQL_DATABASE,
-                'charset': 'utf8mb4',
-                'cursorclass': pymysql.cursors.DictCursor,
-                'autocommit': True
-            }
+                'database': MYSQL_DATABASE
+            }]
+
+            self.shard_configs = []
+            self.shard_names = []
+            for shard in shards:
+                self.shard_configs.append({
+                    'host': shard['host'],
+                    'port': shard['port'],
+                    'user': MYSQL_USER,
+                    'password': MYSQL_PASSWORD,
+                    'database': shard['database'],
+                    'charset': 'utf8mb4',
+                    'cursorclass': pymysql.cursors.DictCursor,
+                    'autocommit': True,
+                    'connect_timeout': MYSQL_CONNECT_TIMEOUT,
+                    'read_timeout': MYSQL_READ_TIMEOUT,
+                    'write_timeout': MYSQL_WRITE_TIMEOUT
+                })
+                self.shard_names.append(f"{shard['host']}:{shard['port']}/{shard['database']}")
+
+            # 维护任务（建表迁移、过期清理、分段导入、分片迁移、快照构建）的语句可能远超请求路径的超时
+            self.maintenance_configs = [
+                dict(config, read_timeout=MYSQL_MAINTENANCE_TIMEOUT or None,
+                     write_timeout=MYSQL_MAINTENANCE_TIMEOUT or None)
+                for config in self.shard_configs
+            ]
+
+            self.config = self.shard_configs[0]
+            self.ring = ConsistentHashRing(self.shard_names)
+            self.breakers = [CircuitBreaker(name) for name in self.shard_names]
 
             # 测试连接
-            test_conn = pymysql.connect(**self.config)
-            test_conn.close()
+            for config in self.shard_configs:
+                test_conn = pymysql.connect(**config)
+                test_conn.close()
 
-            app.logger.info("MySQL connection initialized")
+            app.logger.info(f"MySQL connection initialized ({len(self.shard_configs)} shard(s))")
 
         except Exception as e:
             app.logger.error(f"MySQL initialization failed: {e}")
@@ -170,19 +1005,99 @@ class DatabaseManager:
             app.logger.info("Redis not available, using in-memory cache")
             self.cache = None
 
-    def get_connection(self):
-        """获取数据库连接"""
-        return pymysql.connect(**self.config)
+    @property
+    def shard_count(self):
+        return len(self.shard_configs)
+
+    def shard_for(self, short_code):
+        """根据short_code计算所属分片"""
+        if self.shard_count == 1:
+            return 0
+        return self.ring.get(short_code)
+
+    def candidate_shards(self, short_code):
+        """查找链接时依次尝试的分片；迁移期间未命中时回退到其他分片"""
+        owner = self.shard_for(short_code)
+        if not MYSQL_SHARD_REBALANCING:
+            return [owner]
+        return [owner] + [i for i in range(self.shard_count) if i != owner]
+
+    def link_exists(self, short_code):
+        """短码是否已存在（迁移期间检查所有候选分片）"""
+        return any(
+            self.execute_query("SELECT 1 FROM links WHERE short_code = %s", (short_code,), fetch=True, shard=shard)
+            for shard in self.candidate_shards(short_code)
+        )
+
+    def get_connection(self, shard=0):
+        """获取数据库连接；维护任务中使用长超时配置"""
+        if self.in_maintenance():
+            return pymysql.connect(**self.maintenance_configs[shard])
+        return pymysql.connect(**self.shard_configs[shard])
+
+    @contextmanager
+    def maintenance(self):
+        """在当前线程（协程）中以维护模式执行：连接使用MYSQL_MAINTENANCE_TIMEOUT，不经过熔断器"""
+        previous = self.in_maintenance()
+        self._local.maintenance = True
+        try:
+            yield
+        finally:
+            self._local.maintenance = previous
+
+    def in_maintenance(self):
+        return getattr(self._local, 'maintenance', False)
 
     def return_connection(self, conn):
         """归还数据库连接"""
         conn.close()
 
-    def execute_query(self, query, params=None, fetch=False):
-        """执行数据库查询"""
-        conn = self.get_connection()
+    def _run(self, shard, operation, query, params=None):
+        """在熔断器保护下执行数据库操作，连接类错误计入熔断；记录耗时与慢查询
+
+        维护模式下不检查也不更新熔断器，长时间运行的维护语句不会影响请求路径。
+        """
+        breaker = self.breakers[shard]
+        maintenance = self.in_maintenance()
+        if not maintenance and not breaker.allow():
+            raise DatabaseUnavailable(f'Circuit breaker open for {breaker.name}')
+
         try:
-            cursor = conn.cursor()
+            # 没有连接池，建连耗时单独统计，不计入语句耗时和慢查询判断
+            connect_started = time.perf_counter()
+            conn = self.get_connection(shard)
+            started = time.perf_counter()
+            connect_ms = (started - connect_started) * 1000
+            try:
+                result = operation(conn.cursor())
+                duration_ms = (time.perf_counter() - started) * 1000
+                self._record_timing(conn, shard, query, params, duration_ms, connect_ms)
+            finally:
+                self.return_connection(conn)
+        except Exception as e:
+            if not is_connection_error(e):
+                # 死锁、锁等待超时、SQL错误等说明数据库可达，不计入熔断，原样抛出
+                if not maintenance:
+                    breaker.record_success()
+                raise
+            if not maintenance:
+                breaker.record_failure()
+            raise DatabaseUnavailable(f'{breaker.name}: {e}') from e
+
+        if maintenance:
+            return result
+
+        # 熔断器恢复时立即重放；未达到熔断阈值的失败也可能已写入暂存队列，按间隔检查
+        recovered = breaker.record_success()
+        if recovered or time.time() - self._last_replay_check >= SPOOL_REPLAY_INTERVAL:
+            self._last_replay_check = time.time()
+            if self.spool.pending_bytes():
+                self._schedule_replay()
+        return result
+
+    def execute_query(self, query, params=None, fetch=False, shard=0):
+        """执行数据库查询"""
+        def operation(cursor):
             cursor.execute(query, params or ())
 
             if fetch:
@@ -190,8 +1105,210 @@ class DatabaseManager:
             else:
                 return cursor.rowcount
 
-        finally:
-            self.return_connection(conn)
+        return self._run(shard, operation, query, params)
+
+    def execute_many(self, query, seq_params, shard=0):
+        """批量执行同一语句"""
+        seq_params = list(seq_params)
+        return self._run(shard, lambda cursor: cursor.executemany(query, seq_params), query, seq_params[0] if seq_params else None)
+
+    def _record_timing(self, conn, shard, query, params, duration_ms, connect_ms=0):
+        """记录单条查询耗时：写入当前请求的剖析数据，超过阈值时记录慢查询"""
+        sql = ' '.join(query.split())
+
+        if has_request_context() and g.get('query_timings') is not None:
+            g.query_timings.append({
+                "sql": sql[:500],
+                "shard": self.shard_names[shard],
+                "duration_ms": round(duration_ms, 3),
+                "connect_ms": round(connect_ms, 3)
+            })
+
+        if duration_ms < SLOW_QUERY_MS:
+            return
+
+        explain = None
+        if sql.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE'):
+            try:
+                cursor = conn.cursor()
+                cursor.execute('EXPLAIN ' + query, params or ())
+                explain = cursor.fetchall()
+            except Exception as e:
+                explain = f'EXPLAIN failed: {e}'
+
+        record = {
+            "id": uuid.uuid4().hex,
+            "timestamp": datetime.now().isoformat(),
+            "shard": self.shard_names[shard],
+            "sql": sql,
+            "params": describe_params(params),
+            "duration_ms": round(duration_ms, 3),
+            "connect_ms": round(connect_ms, 3),
+            "explain": explain
+        }
+        slow_query_logger.info(json.dumps(record, default=str, ensure_ascii=False))
+        self.slow_queries.push(record)
+
+    def execute_all(self, query, params=None, fetch=False):
+        """在所有分片上执行查询，返回每个分片的结果列表"""
+        return [
+            self.execute_query(query, params, fetch=fetch, shard=shard)
+            for shard in range(self.shard_count)
+        ]
+
+    def get_cached_link(self, short_code, allow_stale=False):
+        """依次从进程内缓存、Redis读取链接记录；allow_stale时可返回过期的进程内条目"""
+        record = self.local_cache.get(short_code)
+        if record is not None:
+            return record
+
+        if self.cache:
+            try:
+                cached = self.cache.get(f'link:{short_code}')
+                if cached:
+                    record = json.loads(cached)
+                    self.local_cache.set(short_code, record)
+                    return record
+            except Exception as e:
+                app.logger.warning(f'Redis cache read failed for {short_code}: {e}')
+
+        if allow_stale:
+            return self.local_cache.get(short_code, allow_stale=True)
+        return None
+
+    def cache_link(self, short_code, record):
+        """写入进程内缓存和Redis"""
+        self.local_cache.set(short_code, record)
+        if self.cache:
+            try:
+                self.cache.set(f'link:{short_code}', json.dumps(record, default=str), ex=CACHE_TTL)
+            except Exception as e:
+                app.logger.warning(f'Redis cache write failed for {short_code}: {e}')
+
+    def invalidate_link(self, short_code=None):
+        """使链接缓存失效；short_code为空时清空全部"""
+        if short_code is None:
+            self.local_cache.clear()
+        else:
+            self.local_cache.delete(short_code)
+
+        if self.cache:
+            try:
+                if short_code is None:
+                    keys = list(self.cache.scan_iter(match='link:*', count=500))
+                    for i in range(0, len(keys), 500):
+                        self.cache.delete(*keys[i:i + 500])
+                else:
+                    self.cache.delete(f'link:{short_code}')
+            except Exception as e:
+                app.logger.warning(f'Redis cache invalidation failed: {e}')
+
+    def record_click(self, short_code, ip_address, user_agent, referer, clicked_at=None, insert_click=True):
+        """记录一次点击：更新计数并写入点击记录（insert_click为False时只更新计数）
+
+        计数更新带max_clicks条件，返回False表示链接不存在或点击次数已用尽；
+        达到上限的那次点击同时把expires_at设为当前时间，交给过期清理处理。
+        """
+        for shard in self.candidate_shards(short_code):
+            updated = self.execute_query(
+                "UPDATE links SET "
+                "expires_at = IF(max_clicks IS NOT NULL AND click_count + 1 >= max_clicks, "
+                "LEAST(COALESCE(expires_at, NOW()), NOW()), expires_at), "
+                "click_count = click_count + 1, updated_at = CURRENT_TIMESTAMP "
+                "WHERE short_code = %s AND (max_clicks IS NULL OR click_count < max_clicks)",
+                (short_code,), shard=shard
+            )
+            if not updated:
+                continue
+
+            if insert_click and clicked_at:
+                self.execute_query(
+                    "INSERT INTO clicks (short_code, ip_address, user_agent, referer, clicked_at) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    (short_code, ip_address, user_agent, referer, clicked_at), shard=shard
+                )
+            elif insert_click:
+                self.execute_query(
+                    "INSERT INTO clicks (short_code, ip_address, user_agent, referer) VALUES (%s, %s, %s, %s)",
+                    (short_code, ip_address, user_agent, referer), shard=shard
+                )
+            return True
+        return False
+
+    def _apply_spooled(self, kind, payload):
+        """重放一条暂存的写操作"""
+        if kind == 'click':
+            self.record_click(**payload)
+        elif kind == 'create':
+            self.insert_link(
+                payload['short_code'], payload['original_url'], payload['title'],
+                payload.get('expires_at'), payload.get('max_clicks'), created_at=payload['created_at']
+            )
+        else:
+            raise ValueError(f'Unknown spool entry kind: {kind}')
+
+    def execute_transaction(self, operation, shard=0, label='TRANSACTION'):
+        """在同一连接的事务中执行operation(cursor)，异常时回滚"""
+        def run(cursor):
+            conn = cursor.connection
+            conn.begin()
+            try:
+                result = operation(cursor)
+                conn.commit()
+                return result
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+
+        return self._run(shard, run, label)
+
+    def insert_link(self, short_code, original_url, title, expires_at=None, max_clicks=None, created_at=None):
+        """写入链接，并在同一事务中记录变更日志；返回插入行数"""
+        def operation(cursor):
+            cursor.execute(
+                "INSERT INTO links (short_code, original_url, title, created_at, expires_at, max_clicks) "
+                "VALUES (%s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s)",
+                (short_code, original_url, title, created_at, expires_at, max_clicks)
+            )
+            inserted = cursor.rowcount
+            log_link_changes(cursor, [short_code], 'upsert')
+            return inserted
+
+        return self.execute_transaction(operation, self.shard_for(short_code), 'TRANSACTION: INSERT INTO links')
+
+    def delete_link_rows(self, short_code, shard):
+        """删除链接及其点击记录，并在同一事务中记录变更日志；返回删除的链接数"""
+        def operation(cursor):
+            cursor.execute("DELETE FROM clicks WHERE short_code = %s", (short_code,))
+            cursor.execute("DELETE FROM links WHERE short_code = %s", (short_code,))
+            deleted = cursor.rowcount
+            if deleted:
+                log_link_changes(cursor, [short_code], 'delete')
+            return deleted
+
+        return self.execute_transaction(operation, shard, 'TRANSACTION: DELETE FROM links')
+
+    def replay_spool(self):
+        """重放数据库不可用期间暂存的写操作"""
+        if not self.spool.pending_bytes():
+            return 0
+        replayed = self.spool.replay(self._apply_spooled)
+        if replayed:
+            app.logger.info(f'Replayed {replayed} spooled operations')
+        return replayed
+
+    def _schedule_replay(self):
+        """数据库恢复后在后台线程中重放暂存队列"""
+        def worker():
+            try:
+                self.replay_spool()
+            except Exception as e:
+                app.logger.error(f'Spool replay failed: {e}')
+
+        threading.Thread(target=worker, daemon=True).start()
 
 # 数据库管理器（延迟初始化）
 db_manager = None
@@ -203,6 +1320,15 @@ def get_db_manager():
         db_manager = DatabaseManager()
     return db_manager
 
+def maintenance_task(func):
+    """维护任务装饰器：函数内的查询以维护模式执行"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with get_db_manager().maintenance():
+            return func(*args, **kwargs)
+    return wrapper
+
+@maintenance_task
 def init_db():
     """初始化MySQL数据库"""
     db = get_db_manager()
@@ -218,8 +1344,11 @@ def init_db():
                 click_count INT DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                expires_at DATETIME NULL,
+                max_clicks INT NULL,
                 INDEX idx_short_code (short_code),
-                INDEX idx_created_at (created_at)
+                INDEX idx_created_at (created_at),
+                INDEX idx_expires_at (expires_at)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         ''',
         'clicks': '''
@@ -234,16 +1363,61 @@ def init_db():
                 INDEX idx_clicked_at (clicked_at),
                 FOREIGN KEY (short_code) REFERENCES links (short_code) ON DELETE CASCADE
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''',
+        'link_changes': '''
+            CREATE TABLE IF NOT EXISTS link_changes (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                short_code VARCHAR(50),
+                operation VARCHAR(10) NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_changed_at (changed_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        ''',
+        'links_archive': '''
+            CREATE TABLE IF NOT EXISTS links_archive (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                short_code VARCHAR(50) NOT NULL,
+                original_url TEXT NOT NULL,
+                title VARCHAR(500),
+                click_count INT DEFAULT 0,
+                created_at TIMESTAMP NULL,
+                expires_at DATETIME NULL,
+                max_clicks INT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_short_code (short_code)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         '''
     }
 
+    # 已有表补充新增列
+    column_migrations = {
+        'expires_at': "ALTER TABLE links ADD COLUMN expires_at DATETIME NULL, ADD INDEX idx_expires_at (expires_at)",
+        'max_clicks': "ALTER TABLE links ADD COLUMN max_clicks INT NULL"
+    }
+
     try:
-        # 创建表
-        for table_name, create_sql in tables.items():
-            db.execute_query(create_sql)
+        # 在每个分片上创建表
+        for shard in range(db.shard_count):
+            for table_name, create_sql in tables.items():
+                db.execute_query(create_sql, shard=shard)
+
+            existing_columns = {
+                row['COLUMN_NAME'] for row in db.execute_query(
+                    "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'links'",
+                    fetch=True, shard=shard
+                )
+            }
+            for column, alter_sql in column_migrations.items():
+                if column not in existing_columns:
+                    db.execute_query(alter_sql, shard=shard)
+                    app.logger.info(f'Added column links.{column} on {db.shard_names[shard]}')
 
         app.logger.info('MySQL database initialized successfully')
 
+        # 重放上次运行时数据库不可用期间暂存的写操作
+        db.replay_spool()
+
     except Exception as e:
         app.logger.error(f'Database initialization failed: {str(e)}')
         raise
@@ -256,22 +1430,28 @@ def verify_auth():
         return False
     return True
 
-def generate_short_code():
-    """生成短链接代码"""
+def generate_short_code(check_db=True):
+    """生成短链接代码；check_db为False时不查库（数据库不可用时使用）"""
     chars = string.ascii_letters + string.digits
     max_attempts = 10
 
     for _ in range(max_attempts):
         code = ''.join(random.choice(chars) for _ in range(SHORT_CODE_LENGTH))
+        if code in reserved_short_codes():
+            continue
+        if not check_db:
+            return code
 
-        db = get_db_manager()
-        result = db.execute_query("SELECT 1 FROM links WHERE short_code = %s", (code,), fetch=True)
-
-        if not result:
+        if not get_db_manager().link_exists(code):
             return code
 
     raise Exception("Failed to generate unique short code")
 
+def reserved_short_codes():
+    """服务自身路由占用的一级路径（api、health等），不能作为短码"""
+    segments = {rule.rule.strip('/').split('/', 1)[0] for rule in app.url_map.iter_rules()}
+    return {segment for segment in segments if segment and not segment.startswith('<')}
+
 def is_valid_url(url):
     """验证URL格式"""
     url_pattern = re.compile(
@@ -283,6 +1463,47 @@ def is_valid_url(url):
         r'(?:/?|[/?]\S+)$', re.IGNORECASE)
     return url_pattern.match(url) is not None
 
+def parse_expiry(data):
+    """解析创建请求中的过期设置，返回 (expires_at, max_clicks)，非法时抛出ValueError"""
+    expires_at = None
+    if data.get('expires_at'):
+        # Python 3.11之前的fromisoformat不接受UTC后缀Z
+        value = str(data['expires_at'])
+        if value.endswith(('Z', 'z')):
+            value = value[:-1] + '+00:00'
+        try:
+            expires_at = datetime.fromisoformat(value)
+            if expires_at.tzinfo is not None:
+                expires_at = expires_at.astimezone().replace(tzinfo=None)
+        except (ValueError, OverflowError, OSError):
+            raise ValueError("expires_at must be an ISO 8601 datetime")
+    elif data.get('expires_in') is not None:
+        try:
+            expires_in = int(data['expires_in'])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("expires_in must be a number of seconds")
+        try:
+            expires_at = datetime.now() + timedelta(seconds=expires_in)
+        except OverflowError:
+            raise ValueError("expires_in is out of range")
+
+    if expires_at is not None:
+        expires_at = expires_at.replace(microsecond=0)
+        if expires_at <= datetime.now():
+            raise ValueError("Expiry time must be in the future")
+
+    max_clicks = data.get('max_clicks')
+    if max_clicks is not None:
+        if isinstance(max_clicks, bool) or not isinstance(max_clicks, int) or not 1 <= max_clicks <= 2**31 - 1:
+            raise ValueError("max_clicks must be a positive integer")
+
+    return expires_at, max_clicks
+
+def link_expired(record):
+    """根据缓存的链接记录判断是否已过期（不查库）"""
+    expires_at = record.get('expires_at')
+    return bool(expires_at) and datetime.fromisoformat(str(expires_at)) <= datetime.now()
+
 def normalize_url(url):
     """标准化URL，处理中文字符编码"""
     try:
@@ -384,10 +1605,110 @@ def log_response(response):
     # 添加CORS头
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Profile'
 
     return response
 
+# 按需性能剖析：带认证的 X-Profile: 1 请求头，或按 PROFILE_SAMPLE_RATE 随机采样
+# cProfile同一时刻只能剖析一个请求，忙时跳过
+profile_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """只统计当前请求的cProfile剖析器
+
+    cProfile作用于整个OS线程；gevent下同一线程上还运行着其他请求的协程，
+    因此通过greenlet.settrace在切换出当前协程时暂停剖析、切换回来时恢复。
+    等待I/O期间不计入调用栈统计，只体现在总耗时中。
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.scope = 'thread'
+        self._greenlet = None
+        self._previous_trace = None
+
+    def _on_switch(self, event, args):
+        origin, target = args
+        if origin is self._greenlet:
+            self.profiler.disable()
+        elif target is self._greenlet:
+            self.profiler.enable()
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def start(self):
+        if greenlet is not None:
+            self.scope = 'greenlet'
+            self._greenlet = greenlet.getcurrent()
+            self._previous_trace = greenlet.settrace(self._on_switch)
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        if self._greenlet is not None:
+            greenlet.settrace(self._previous_trace)
+            self._greenlet = None
+
+@app.before_request
+def start_profiling():
+    """根据请求头或采样率开启本次请求的剖析"""
+    requested = request.headers.get('X-Profile') == '1' and verify_auth()
+    if not requested and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        return
+    if not profile_lock.acquire(blocking=False):
+        return
+
+    g.query_timings = []
+    g.profile_started = time.perf_counter()
+    g.profiler = RequestProfiler()
+    g.profiler.start()
+
+@app.after_request
+def finish_profiling(response):
+    """结束剖析并保存调用栈统计与查询耗时明细"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+
+    try:
+        profiler.stop()
+        duration_ms = (time.perf_counter() - g.profile_started) * 1000
+        stats_output = io.StringIO()
+        pstats.Stats(profiler.profiler, stream=stats_output).sort_stats('cumulative').print_stats(40)
+
+        queries = g.pop('query_timings', [])
+        record = {
+            "id": uuid.uuid4().hex,
+            "timestamp": datetime.now().isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(duration_ms, 3),
+            "query_count": len(queries),
+            "query_ms": round(sum(q['duration_ms'] for q in queries), 3),
+            "connect_ms": round(sum(q['connect_ms'] for q in queries), 3),
+            "queries": queries,
+            "profile_scope": profiler.scope,
+            "profile": stats_output.getvalue()
+        }
+        get_db_manager().profiles.push(record)
+        response.headers['X-Profile-Id'] = record['id']
+    except Exception as e:
+        app.logger.warning(f'Failed to save request profile: {e}')
+    finally:
+        profile_lock.release()
+
+    return response
+
+@app.teardown_request
+def release_profiler(exc):
+    """请求异常结束时释放剖析器"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        profile_lock.release()
+
 # 处理OPTIONS请求
 @app.route('/api/<path:path>', methods=['OPTIONS'])
 def handle_options(path):
@@ -440,20 +1761,51 @@ def create_short_link():
                 return jsonify({"error": "Custom code must be 3-20 characters"}), 400
             if not re.match(r'^[a-zA-Z0-9_-]+$', custom_code):
                 return jsonify({"error": "Custom code can only contain letters, numbers, _ and -"}), 400
-            short_code = custom_code
-        else:
-            short_code = generate_short_code()
+            if custom_code in reserved_short_codes():
+                return jsonify({"error": "Custom code is reserved"}), 400
+
+        # 验证过期设置
+        try:
+            expires_at, max_clicks = parse_expiry(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # 保存到数据库
         db = get_db_manager()
+        queued = False
 
-        result = db.execute_query(
-            "INSERT INTO links (short_code, original_url, title) VALUES (%s, %s, %s)",
-            (short_code, original_url, title)
-        )
+        try:
+            # 自定义短码查重（迁移期间旧分片上的同名链接也要检查）
+            if custom_code and db.link_exists(custom_code):
+                return jsonify({"error": "Short code already exists"}), 409
+            short_code = custom_code or generate_short_code()
+            result = db.insert_link(short_code, original_url, title, expires_at, max_clicks)
+        except DatabaseUnavailable as e:
+            # 降级：写入本地队列，恢复后重放。无法查库确认唯一性，
+            # 自定义短码不接受；随机短码只避开缓存和快照中已知的短码
+            if custom_code:
+                if db.get_cached_link(custom_code, allow_stale=True) or lookup_snapshot(custom_code):
+                    return jsonify({"error": "Short code already exists"}), 409
+                return jsonify({"error": "Service temporarily unavailable, custom codes cannot be verified"}), 503
+
+            app.logger.warning(f'Database unavailable, spooling create: {e}')
+            for _ in range(10):
+                short_code = generate_short_code(check_db=False)
+                if not (db.get_cached_link(short_code, allow_stale=True) or lookup_snapshot(short_code)):
+                    break
+            db.spool.append('create', {
+                "short_code": short_code,
+                "original_url": original_url,
+                "title": title,
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "expires_at": expires_at.isoformat() if expires_at else None,
+                "max_clicks": max_clicks
+            })
+            queued = True
+            result = 1
 
         if result:
-            app.logger.info(f'Created short link: {short_code} -> {original_url}')
+            app.logger.info(f'Created short link: {short_code} -> {original_url} (queued={queued})')
 
             # 生成短链接URL
             short_url = f"{BASE_URL}/{short_code}"
@@ -467,13 +1819,19 @@ def create_short_link():
                 "short_url": short_url,
                 "original_url": original_url,
                 "title": title,
-                "created_at": datetime.now().isoformat()
+                "created_at": datetime.now().isoformat(),
+                "expires_at": expires_at.isoformat() if expires_at else None,
+                "max_clicks": max_clicks
             }
 
             # 如果二维码生成成功，添加到响应中
             if qr_code_base64:
                 response_data["qr_code"] = qr_code_base64
 
+            if queued:
+                response_data["queued"] = True
+                return jsonify(response_data), 202
+
             return jsonify(response_data), 201
         else:
             return jsonify({"error": "Failed to create short link"}), 500
@@ -498,17 +1856,34 @@ def list_links():
 
         db = get_db_manager()
 
-        # 获取总数
-        total_result = db.execute_query("SELECT COUNT(*) as count FROM links", fetch=True)
-        total = total_result[0]['count'] if total_result else 0
+        # 多分片归并需要每个分片返回offset+limit条，限制分页深度
+        if db.shard_count > 1 and offset > SHARD_LIST_MAX_OFFSET:
+            return jsonify({
+                "error": f"Page too deep, at most {SHARD_LIST_MAX_OFFSET // limit + 1} pages with limit={limit}"
+            }), 400
 
-        # 获取链接列表
-        links_result = db.execute_query(
-            "SELECT short_code, original_url, title, click_count, created_at FROM links "
-            "ORDER BY created_at DESC LIMIT %s OFFSET %s",
-            (limit, offset), fetch=True
+        # 获取总数（各分片求和）
+        total = sum(
+            result[0]['count'] if result else 0
+            for result in db.execute_all("SELECT COUNT(*) as count FROM links", fetch=True)
         )
 
+        # 获取链接列表：单分片直接分页，多分片各取前offset+limit条后归并
+        if db.shard_count == 1:
+            links_result = db.execute_query(
+                "SELECT short_code, original_url, title, click_count, created_at, expires_at, max_clicks FROM links "
+                "ORDER BY created_at DESC LIMIT %s OFFSET %s",
+                (limit, offset), fetch=True
+            )
+        else:
+            shard_results = db.execute_all(
+                "SELECT short_code, original_url, title, click_count, created_at, expires_at, max_clicks FROM links "
+                "ORDER BY created_at DESC LIMIT %s",
+                (offset + limit,), fetch=True
+            )
+            merged = heapq.merge(*shard_results, key=lambda row: row['created_at'], reverse=True)
+            links_result = list(merged)[offset:offset + limit]
+
         links = []
         if links_result:
             for row in links_result:
@@ -518,7 +1893,9 @@ def list_links():
                     "original_url": row['original_url'],
                     "title": row['title'],
                     "click_count": row['click_count'],
-                    "created_at": str(row['created_at'])
+                    "created_at": str(row['created_at']),
+                    "expires_at": str(row['expires_at']) if row['expires_at'] else None,
+                    "max_clicks": row['max_clicks']
                 })
 
         return jsonify({
@@ -532,6 +1909,9 @@ def list_links():
             }
         })
             
+    except DatabaseUnavailable as e:
+        app.logger.error(f'Database unavailable: {e}')
+        return jsonify({"error": "Service temporarily unavailable"}), 503
     except Exception as e:
         app.logger.error(f'Error listing links: {str(e)}')
         return jsonify({"error": "Internal server error"}), 500
@@ -543,24 +1923,39 @@ def get_stats(short_code):
         return jsonify({"error": "Unauthorized"}), 401
     
     try:
+        days = min(SKETCH_RETENTION_DAYS, max(1, int(request.args.get('days', SKETCH_DEFAULT_DAYS))))
         db = get_db_manager()
 
         # 获取链接信息
-        link_result = db.execute_query(
-            "SELECT original_url, title, click_count, created_at FROM links WHERE short_code = %s",
-            (short_code,), fetch=True
-        )
-        link = link_result[0] if link_result else None
+        link = None
+        for shard in db.candidate_shards(short_code):
+            link_result = db.execute_query(
+                "SELECT original_url, title, click_count, created_at, expires_at, max_clicks FROM links "
+                "WHERE short_code = %s",
+                (short_code,), fetch=True, shard=shard
+            )
+            if link_result:
+                link = link_result[0]
+                break
+
+        if not link:
+            return jsonify({"error": "Short link not found"}), 404
 
         # 获取点击记录
         clicks_result = db.execute_query(
             "SELECT ip_address, user_agent, referer, clicked_at FROM clicks "
             "WHERE short_code = %s ORDER BY clicked_at DESC LIMIT 100",
-            (short_code,), fetch=True
+            (short_code,), fetch=True, shard=shard
         )
 
-        if not link:
-            return jsonify({"error": "Short link not found"}), 404
+        # 合并尚未导入MySQL的点击分段
+        click_count = link['click_count']
+        segment_clicks, uncounted = db.click_log.recent_clicks(short_code)
+        if segment_clicks:
+            click_count += uncounted
+            clicks_result = sorted(
+                list(clicks_result or []) + segment_clicks, key=lambda c: c['clicked_at'], reverse=True
+            )[:100]
 
         # 处理点击记录
         recent_clicks = []
@@ -573,17 +1968,30 @@ def get_stats(short_code):
                     "clicked_at": str(click['clicked_at'])
                 })
 
+        # 独立访客与Top-K来源/UA（按日草图合并）
+        try:
+            sketch_stats = db.sketches.query(short_code, days=days)
+        except Exception as e:
+            app.logger.warning(f'Failed to query sketches for {short_code}: {e}')
+            sketch_stats = None
+
         return jsonify({
             "success": True,
             "short_code": short_code,
             "short_url": f"{BASE_URL}/{short_code}",
             "original_url": link['original_url'],
             "title": link['title'],
-            "click_count": link['click_count'],
+            "click_count": click_count,
             "created_at": str(link['created_at']),
-            "recent_clicks": recent_clicks
+            "expires_at": str(link['expires_at']) if link['expires_at'] else None,
+            "max_clicks": link['max_clicks'],
+            "recent_clicks": recent_clicks,
+            "sketches": sketch_stats
         })
             
+    except DatabaseUnavailable as e:
+        app.logger.error(f'Database unavailable: {e}')
+        return jsonify({"error": "Service temporarily unavailable"}), 503
     except Exception as e:
         app.logger.error(f'Error getting stats for {short_code}: {str(e)}')
         return jsonify({"error": "Internal server error"}), 500
@@ -597,18 +2005,27 @@ def delete_link(short_code):
     try:
         db = get_db_manager()
 
-        # 删除相关的点击记录
-        db.execute_query("DELETE FROM clicks WHERE short_code = %s", (short_code,))
-
-        # 删除链接
-        result = db.execute_query("DELETE FROM links WHERE short_code = %s", (short_code,))
+        result = 0
+        for shard in db.candidate_shards(short_code):
+            # 删除链接及相关的点击记录
+            result += db.delete_link_rows(short_code, shard)
 
         if result == 0:
             return jsonify({"error": "Short link not found"}), 404
 
+        db.invalidate_link(short_code)
+
+        try:
+            db.sketches.delete(short_code)
+        except Exception as e:
+            app.logger.warning(f'Failed to delete sketches for {short_code}: {e}')
+
         app.logger.info(f'Deleted short link: {short_code}')
         return jsonify({"success": True, "message": "Short link deleted"})
             
+    except DatabaseUnavailable as e:
+        app.logger.error(f'Database unavailable: {e}')
+        return jsonify({"error": "Service temporarily unavailable"}), 503
     except Exception as e:
         app.logger.error(f'Error deleting link {short_code}: {str(e)}')
         return jsonify({"error": "Internal server error"}), 500
@@ -619,29 +2036,77 @@ def redirect_link(short_code):
     try:
         db = get_db_manager()
 
-        # 获取原始URL
-        result = db.execute_query("SELECT original_url FROM links WHERE short_code = %s", (short_code,), fetch=True)
-
-        if not result:
-            return jsonify({"error": "Short link not found"}), 404
-
-        original_url = result[0]['original_url']
+        # 获取链接记录：先查缓存，未命中再查库
+        record = db.get_cached_link(short_code)
+        if record is None:
+            try:
+                result = None
+                for shard in db.candidate_shards(short_code):
+                    result = db.execute_query(
+                        "SELECT original_url, expires_at, max_clicks FROM links WHERE short_code = %s",
+                        (short_code,), fetch=True, shard=shard
+                    )
+                    if result:
+                        break
+
+                if not result:
+                    return jsonify({"error": "Short link not found"}), 404
+
+                row = result[0]
+                record = {
+                    "original_url": row['original_url'],
+                    "expires_at": row['expires_at'].isoformat() if row['expires_at'] else None,
+                    "max_clicks": row['max_clicks']
+                }
+                db.cache_link(short_code, record)
+            except DatabaseUnavailable as e:
+                # 降级：数据库不可用时使用已过期的本地缓存，其次是重定向快照
+                record = db.get_cached_link(short_code, allow_stale=True) or lookup_snapshot(short_code)
+                if record is None:
+                    app.logger.error(f'Database unavailable and {short_code} not cached: {e}')
+                    return jsonify({"error": "Service temporarily unavailable"}), 503
+
+        # 惰性过期检查：只使用缓存记录，不额外查库
+        if link_expired(record):
+            return jsonify({"error": "Short link expired"}), 410
+
+        original_url = record['original_url']
 
         # 记录点击
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR'))
         user_agent = request.headers.get('User-Agent', '')
         referer = request.headers.get('Referer', '')
 
-        db.execute_query(
-            "INSERT INTO clicks (short_code, ip_address, user_agent, referer) VALUES (%s, %s, %s, %s)",
-            (short_code, ip_address, user_agent, referer)
-        )
+        try:
+            segments = CLICK_SINK == 'segments'
+            if segments and not record.get('max_clicks'):
+                # 普通链接只追加到本地分段日志，不写数据库
+                db.click_log.append(short_code, ip_address, user_agent, referer)
+            elif not db.record_click(short_code, ip_address, user_agent, referer, insert_click=not segments):
+                if record.get('max_clicks'):
+                    # 点击次数已用尽：缓存标记为过期，后续请求不再查库
+                    db.cache_link(short_code, {**record, "expires_at": datetime.now().isoformat()})
+                    return jsonify({"error": "Short link expired"}), 410
+                # 缓存中的链接已被删除
+                db.invalidate_link(short_code)
+                return jsonify({"error": "Short link not found"}), 404
+            elif segments:
+                # 有点击上限的链接计数已在数据库中累加，记录标记为已计数
+                db.click_log.append(short_code, ip_address, user_agent, referer, counted=True)
+        except DatabaseUnavailable:
+            db.spool.append('click', {
+                "short_code": short_code,
+                "ip_address": ip_address,
+                "user_agent": user_agent,
+                "referer": referer,
+                "clicked_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
 
-        # 更新点击计数
-        db.execute_query(
-            "UPDATE links SET click_count = click_count + 1, updated_at = CURRENT_TIMESTAMP WHERE short_code = %s",
-            (short_code,)
-        )
+        # 更新统计草图（失败不影响重定向）
+        try:
+            db.sketches.record(short_code, ip_address, user_agent, referer)
+        except Exception as e:
+            app.logger.warning(f'Failed to update sketches for {short_code}: {e}')
 
         app.logger.info(f'Redirected {short_code} -> {original_url} from {ip_address}')
         return redirect(original_url)
@@ -659,18 +2124,31 @@ def clear_all_links():
     try:
         db = get_db_manager()
 
-        # 获取删除前的统计
-        total_result = db.execute_query("SELECT COUNT(*) as count FROM links", fetch=True)
-        total_links = total_result[0]['count'] if total_result else 0
+        # 获取删除前的统计（各分片求和）
+        total_links = sum(
+            result[0]['count'] if result else 0
+            for result in db.execute_all("SELECT COUNT(*) as count FROM links", fetch=True)
+        )
+        total_clicks = sum(
+            result[0]['count'] if result else 0
+            for result in db.execute_all("SELECT COUNT(*) as count FROM clicks", fetch=True)
+        )
+
+        # 每个分片在同一事务中删除所有点击记录和链接，并记录清空
+        def clear_shard(cursor):
+            cursor.execute("DELETE FROM clicks")
+            cursor.execute("DELETE FROM links")
+            log_link_changes(cursor, [None], 'clear')
 
-        clicks_result = db.execute_query("SELECT COUNT(*) as count FROM clicks", fetch=True)
-        total_clicks = clicks_result[0]['count'] if clicks_result else 0
+        for shard in range(db.shard_count):
+            db.execute_transaction(clear_shard, shard, 'TRANSACTION: DELETE FROM links')
 
-        # 删除所有点击记录
-        db.execute_query("DELETE FROM clicks")
+        db.invalidate_link()
 
-        # 删除所有链接
-        db.execute_query("DELETE FROM links")
+        try:
+            db.sketches.delete()
+        except Exception as e:
+            app.logger.warning(f'Failed to clear sketches: {e}')
 
         app.logger.info(f'Cleared all links: {total_links} links, {total_clicks} clicks')
 
@@ -683,26 +2161,67 @@ def clear_all_links():
             }
         })
 
+    except DatabaseUnavailable as e:
+        app.logger.error(f'Database unavailable: {e}')
+        return jsonify({"error": "Service temporarily unavailable"}), 503
     except Exception as e:
         app.logger.error(f'Error clearing links: {str(e)}')
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """最近的请求剖析记录（不含调用栈详情）"""
+    if not verify_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    db = get_db_manager()
+    profiles = [
+        {k: v for k, v in record.items() if k not in ('profile', 'queries')}
+        for record in db.profiles.list()
+    ]
+    return jsonify({"success": True, "profiles": profiles})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """单条剖析记录：调用栈统计与查询耗时明细"""
+    if not verify_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    record = get_db_manager().profiles.get(profile_id)
+    if not record:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({"success": True, "profile": record})
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def list_slow_queries():
+    """最近的慢查询（含EXPLAIN）"""
+    if not verify_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return jsonify({"success": True, "slow_queries": get_db_manager().slow_queries.list()})
+
 @app.route('/health')
 def health_check():
     """健康检查"""
     try:
         # 检查数据库连接
         db = get_db_manager()
-        try:
-            db.execute_query("SELECT 1")
-            db_status = "ok"
-        except Exception:
-            db_status = "error"
+        shards = []
+        for shard, name in enumerate(db.shard_names):
+            try:
+                db.execute_query("SELECT 1", shard=shard)
+                status = "ok"
+            except Exception:
+                status = "error"
+            shards.append({"shard": name, "status": status, "circuit_breaker": db.breakers[shard].snapshot()})
+        db_status = "ok" if all(item['status'] == 'ok' for item in shards) else "error"
         
         return jsonify({
             "status": "ok",
             "timestamp": datetime.now().isoformat(),
             "database": db_status,
+            "shards": shards,
+            "spool_pending_bytes": db.spool.pending_bytes(),
             "version": "1.0.0"
         })
     except Exception as e:
@@ -722,6 +2241,9 @@ def index():
             "GET /api/stats/<code>": "Get link statistics",
             "DELETE /api/delete/<code>": "Delete short link",
             "GET /<code>": "Redirect to original URL",
+            "GET /api/admin/profiles": "Recent request profiles (X-Profile: 1 to record one)",
+            "GET /api/admin/profiles/<id>": "Request profile details",
+            "GET /api/admin/slow-queries": "Recent slow queries",
             "GET /health": "Health check"
         },
         "authentication": "Authorization header required",
@@ -737,9 +2259,579 @@ def internal_error(error):
     app.logger.error(f'Internal server error: {str(error)}')
     return jsonify({"error": "Internal server error"}), 500
 
+def move_link(db, short_code, source, target):
+    """将一个链接及其点击记录从source分片迁移到target分片
+
+    先复制链接行，使查找立即命中新分片，再复制点击记录并补齐
+    复制期间新增的计数，最后从源分片删除。目标分片上已有同名的
+    其他链接时不迁移，返回None。
+    """
+    rows = db.execute_query("SELECT * FROM links WHERE short_code = %s", (short_code,), fetch=True, shard=source)
+    if not rows:
+        return 0
+    link = {k: v for k, v in rows[0].items() if k != 'id'}
+    columns = ', '.join(link)
+    placeholders = ', '.join(['%s'] * len(link))
+
+    def copy_link(cursor):
+        cursor.execute(f"INSERT IGNORE INTO links ({columns}) VALUES ({placeholders})", tuple(link.values()))
+        if not cursor.rowcount:
+            cursor.execute("SELECT original_url, created_at FROM links WHERE short_code = %s", (short_code,))
+            existing = cursor.fetchall()
+            # 上次迁移中断留下的副本可以继续；否则是不同的链接，保留源分片数据
+            if not existing or (existing[0]['original_url'], existing[0]['created_at']) != \
+                    (link['original_url'], link['created_at']):
+                return False
+        log_link_changes(cursor, [short_code], 'upsert')
+        return True
+
+    if not db.execute_transaction(copy_link, target, 'TRANSACTION: INSERT IGNORE INTO links'):
+        app.logger.error(f'Shard move conflict for {short_code}: a different link exists on the target shard')
+        return None
+
+    clicks = db.execute_query(
+        "SELECT short_code, ip_address, user_agent, referer, clicked_at FROM clicks WHERE short_code = %s",
+        (short_code,), fetch=True, shard=source
+    )
+    if clicks:
+        db.execute_many(
+            "INSERT INTO clicks (short_code, ip_address, user_agent, referer, clicked_at) VALUES (%s, %s, %s, %s, %s)",
+            [(c['short_code'], c['ip_address'], c['user_agent'], c['referer'], c['clicked_at']) for c in clicks],
+            shard=target
+        )
+
+    # 补齐复制期间源分片上新增的点击计数
+    latest = db.execute_query(
+        "SELECT click_count FROM links WHERE short_code = %s", (short_code,), fetch=True, shard=source
+    )
+    if latest and latest[0]['click_count'] > link['click_count']:
+        db.execute_query(
+            "UPDATE links SET click_count = click_count + %s WHERE short_code = %s",
+            (latest[0]['click_count'] - link['click_count'], short_code), shard=target
+        )
+
+    db.delete_link_rows(short_code, source)
+    return len(clicks) if clicks else 0
+
+@app.cli.command('rebalance-shards')
+@click.option('--batch-size', default=500, show_default=True, help='每批扫描的链接数')
+@click.option('--dry-run', is_flag=True, help='只统计需要迁移的链接，不实际迁移')
+@maintenance_task
+def rebalance_shards(batch_size, dry_run):
+    """在线迁移链接到一致性哈希计算出的目标分片
+
+    新增分片时：把新分片加入MYSQL_SHARDS并设置MYSQL_SHARD_REBALANCING=true后重启服务，
+    执行本命令，完成后关闭MYSQL_SHARD_REBALANCING。
+    """
+    db = get_db_manager()
+    if db.shard_count == 1:
+        click.echo('Only one shard configured, nothing to rebalance')
+        return
+
+    moved_links = 0
+    moved_clicks = 0
+    conflicts = []
+    for source, name in enumerate(db.shard_names):
+        last_id = 0
+        while True:
+            rows = db.execute_query(
+                "SELECT id, short_code FROM links WHERE id > %s ORDER BY id LIMIT %s",
+                (last_id, batch_size), fetch=True, shard=source
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            for row in rows:
+                target = db.shard_for(row['short_code'])
+                if target == source:
+                    continue
+                if dry_run:
+                    moved_links += 1
+                    continue
+                clicks = move_link(db, row['short_code'], source, target)
+                if clicks is None:
+                    conflicts.append(row['short_code'])
+                    continue
+                moved_links += 1
+                moved_clicks += clicks
+
+        click.echo(f'Scanned shard {name}')
+
+    action = 'Would move' if dry_run else 'Moved'
+    click.echo(f'{action} {moved_links} links ({moved_clicks} clicks)')
+    if conflicts:
+        click.echo(f'Skipped {len(conflicts)} conflicting codes (left on their current shard): {", ".join(conflicts)}')
+    app.logger.info(f'Shard rebalance finished: {moved_links} links, {moved_clicks} clicks, dry_run={dry_run}')
+
+# 重定向快照：short_code -> URL 的有序二进制文件 + Nginx map
+# 文件格式: 头部(魔数, 条数) + (条数+1)个uint32记录偏移 + 记录(uint8代码长度, 代码, URL)
+SNAPSHOT_MAGIC = b'SLMAP\x01'
+SNAPSHOT_HEADER = struct.Struct('<6sI')
+SNAPSHOT_OFFSET = struct.Struct('<I')
+
+
+class RedirectSnapshot:
+    """只读访问重定向快照文件（mmap + 二分查找）"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = SNAPSHOT_HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f'Not a redirect snapshot: {path}')
+        self._data_start = SNAPSHOT_HEADER.size + (self.count + 1) * SNAPSHOT_OFFSET.size
+
+    def _record(self, index):
+        start, end = (
+            self._data_start + SNAPSHOT_OFFSET.unpack_from(
+                self._mm, SNAPSHOT_HEADER.size + i * SNAPSHOT_OFFSET.size)[0]
+            for i in (index, index + 1)
+        )
+        code_len = self._mm[start]
+        code = self._mm[start + 1:start + 1 + code_len]
+        return code, start + 1 + code_len, end
+
+    def lookup(self, short_code):
+        """二分查找short_code对应的URL"""
+        key = short_code.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            code, url_start, url_end = self._record(mid)
+            if code == key:
+                return self._mm[url_start:url_end].decode('utf-8')
+            if code < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def items(self):
+        for index in range(self.count):
+            code, url_start, url_end = self._record(index)
+            yield code.decode('utf-8'), self._mm[url_start:url_end].decode('utf-8')
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+snapshot_reader = None
+
+def lookup_snapshot(short_code):
+    """从最新的重定向快照中查找链接（快照文件替换后自动重新打开）"""
+    global snapshot_reader
+    path = os.path.join(SNAPSHOT_DIR, 'redirects.bin')
+    try:
+        inode = os.stat(path).st_ino
+        if snapshot_reader is None or snapshot_reader[0] != inode:
+            if snapshot_reader is not None:
+                snapshot_reader[1].close()
+            snapshot_reader = (inode, RedirectSnapshot(path))
+        original_url = snapshot_reader[1].lookup(short_code)
+    except (OSError, ValueError):
+        return None
+    return {"original_url": original_url} if original_url else None
+
+
+def write_atomic(path, write):
+    """写入临时文件并fsync后原子替换目标文件"""
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_snapshot_file(path, mapping):
+    """按short_code排序写出二进制快照"""
+    def write(f):
+        records = []
+        offsets = [0]
+        for code, url in sorted(mapping.items()):
+            code_bytes = code.encode('utf-8')
+            record = bytes([len(code_bytes)]) + code_bytes + url.encode('utf-8')
+            records.append(record)
+            offsets.append(offsets[-1] + len(record))
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(records)))
+        f.write(b''.join(SNAPSHOT_OFFSET.pack(offset) for offset in offsets))
+        f.write(b''.join(records))
+
+    write_atomic(path, write)
+
+
+def write_nginx_map(path, mapping):
+    """写出Nginx map include文件: $uri -> $shortlink_target"""
+    def quote_value(value):
+        # Nginx map值中的$会被当作变量，编码为%24
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('$', '%24') + '"'
+
+    def write(f):
+        f.write(f'# Generated by build-redirect-snapshot at {datetime.now().isoformat()}\n'.encode('utf-8'))
+        f.write(b'map $uri $shortlink_target {\n    default "";\n')
+        for code, url in sorted(mapping.items()):
+            f.write(f'    {quote_value("/" + code)} {quote_value(url)};\n'.encode('utf-8'))
+        f.write(b'}\n')
+
+    write_atomic(path, write)
+
+
+@maintenance_task
+def build_redirect_snapshot(db, directory=SNAPSHOT_DIR, full=False, batch_size=1000):
+    """根据变更日志增量构建重定向快照，无历史快照或变更日志不连续时全量重建
+
+    设置了过期时间或点击上限的链接不进入快照，由Flask负责校验。
+
+    返回 (链接数, 是否全量重建)。
+    """
+    os.makedirs(directory, exist_ok=True)
+    bin_path = os.path.join(directory, 'redirects.bin')
+    map_path = os.path.join(directory, 'redirects.map')
+    state_path = os.path.join(directory, 'redirects.state.json')
+
+    state = {}
+    if not full and os.path.exists(state_path) and os.path.exists(bin_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    watermarks = state.get('watermarks', {})
+    scanned_at = state.get('scanned_at', {})
+    applied_clears = state.get('clears', {})
+    full = full or set(watermarks) != set(db.shard_names)
+
+    # 读取各分片在水位之后的变更
+    changed_codes = set()
+    new_watermarks = {}
+    new_scanned_at = {}
+    new_clears = {}
+    for shard, name in enumerate(db.shard_names):
+        bounds = db.execute_query(
+            "SELECT MIN(id) AS min_id, MAX(id) AS max_id, NOW() AS scanned_at FROM link_changes",
+            fetch=True, shard=shard
+        )[0]
+        new_watermarks[name] = bounds['max_id'] or 0
+        new_scanned_at[name] = str(bounds['scanned_at'])
+        if name not in watermarks:
+            continue
+
+        last_id = watermarks[name]
+        if bounds['min_id'] and bounds['min_id'] > last_id + 1:
+            full = True  # 水位之后的变更已被清理，只能全量重建
+
+        # 自增id在插入时分配，事务提交顺序可能不同：上次构建时尚未提交的较小id会落在水位之下，
+        # 因此重新读取上次构建前SNAPSHOT_CHANGE_OVERLAP秒以来的变更（按当前数据库状态解析，重复读取无副作用）
+        if name in scanned_at:
+            overlap = db.execute_query(
+                "SELECT MIN(id) AS id FROM link_changes WHERE changed_at >= %s",
+                (datetime.fromisoformat(scanned_at[name]) - timedelta(seconds=SNAPSHOT_CHANGE_OVERLAP),),
+                fetch=True, shard=shard
+            )[0]['id']
+            if overlap:
+                last_id = min(last_id, overlap - 1)
+
+        # 已应用过的清空（上次全量重建时已可见）不再触发重建
+        new_clears[name] = [row['id'] for row in db.execute_query(
+            "SELECT id FROM link_changes WHERE id > %s AND id <= %s AND operation = 'clear'",
+            (last_id, new_watermarks[name]), fetch=True, shard=shard
+        )]
+        if set(new_clears[name]) - set(applied_clears.get(name, [])):
+            full = True
+        if full:
+            continue
+
+        while last_id < new_watermarks[name]:
+            rows = db.execute_query(
+                "SELECT id, short_code, operation FROM link_changes WHERE id > %s AND id <= %s ORDER BY id LIMIT %s",
+                (last_id, new_watermarks[name], batch_size), fetch=True, shard=shard
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            changed_codes.update(row['short_code'] for row in rows if row['operation'] != 'clear')
+
+    mapping = {}
+    if full:
+        # 全量：扫描所有分片（水位先于扫描读取，扫描期间的变更下次会再应用）
+        for shard in range(db.shard_count):
+            last_id = 0
+            while True:
+                rows = db.execute_query(
+                    "SELECT id, short_code, original_url, expires_at, max_clicks FROM links "
+                    "WHERE id > %s ORDER BY id LIMIT %s",
+                    (last_id, batch_size), fetch=True, shard=shard
+                )
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                mapping.update(
+                    (row['short_code'], row['original_url']) for row in rows
+                    if row['expires_at'] is None and row['max_clicks'] is None
+                )
+    else:
+        snapshot = RedirectSnapshot(bin_path)
+        try:
+            mapping = dict(snapshot.items())
+        finally:
+            snapshot.close()
+
+        # 按当前数据库状态解析变更过的代码：存在则更新，不存在则删除
+        codes = sorted(changed_codes)
+        for i in range(0, len(codes), batch_size):
+            batch = codes[i:i + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            current = {}
+            for shard in range(db.shard_count):
+                rows = db.execute_query(
+                    f"SELECT short_code, original_url FROM links WHERE short_code IN ({placeholders}) "
+                    "AND expires_at IS NULL AND max_clicks IS NULL",
+                    tuple(batch), fetch=True, shard=shard
+                )
+                current.update((row['short_code'], row['original_url']) for row in rows)
+            for code in batch:
+                if code in current:
+                    mapping[code] = current[code]
+                else:
+                    mapping.pop(code, None)
+
+    # 与服务自身路由同名的短码（例如升级前创建的health）不能进入快照，否则Nginx会截走这些路径
+    reserved = reserved_short_codes()
+    mapping = {code: url for code, url in mapping.items() if code not in reserved}
+
+    write_snapshot_file(bin_path, mapping)
+    write_nginx_map(map_path, mapping)
+    write_atomic(state_path, lambda f: f.write(json.dumps({
+        "watermarks": new_watermarks,
+        "scanned_at": new_scanned_at,
+        "clears": new_clears,
+        "count": len(mapping),
+        "built_at": datetime.now().isoformat()
+    }).encode('utf-8')))
+
+    # 清理超过保留期的变更日志
+    for shard in range(db.shard_count):
+        while db.execute_query(
+            "DELETE FROM link_changes WHERE changed_at < NOW() - INTERVAL %s DAY LIMIT 10000",
+            (SNAPSHOT_CHANGELOG_RETENTION_DAYS,), shard=shard
+        ) >= 10000:
+            pass
+
+    return len(mapping), full
+
+@app.cli.command('build-redirect-snapshot')
+@click.option('--full', is_flag=True, help='忽略变更日志，全量重建')
+@click.option('--directory', default=SNAPSHOT_DIR, show_default=True, help='快照输出目录')
+@click.option('--reload-cmd', default='', help='快照替换后执行的命令，例如 "nginx -s reload"')
+def build_redirect_snapshot_command(full, directory, reload_cmd):
+    """构建重定向快照（二进制文件 + Nginx map），供边缘层直接响应跳转"""
+    count, rebuilt = build_redirect_snapshot(get_db_manager(), directory, full=full)
+    click.echo(f'Snapshot written to {directory}: {count} links ({"full" if rebuilt else "incremental"})')
+    app.logger.info(f'Redirect snapshot built: {count} links, full={rebuilt}')
+
+    if reload_cmd:
+        subprocess.run(reload_cmd, shell=True, check=True)
+
+@maintenance_task
+def sweep_expired_links(db, batch_size=SWEEP_BATCH_SIZE, mode=SWEEP_MODE):
+    """按expires_at索引小批量删除（或归档）已过期的链接，并使缓存失效，返回处理的链接数
+
+    每批在一个事务中用SELECT ... FOR UPDATE锁定过期链接，再归档、删除并记录变更，
+    并发执行时同一链接不会被重复归档。
+    """
+    def sweep_batch(cursor):
+        cursor.execute(
+            "SELECT short_code FROM links WHERE expires_at <= NOW() ORDER BY expires_at LIMIT %s FOR UPDATE",
+            (batch_size,)
+        )
+        codes = [row['short_code'] for row in cursor.fetchall()]
+        if not codes:
+            return codes
+
+        placeholders = ', '.join(['%s'] * len(codes))
+        if mode == 'archive':
+            cursor.execute(
+                "INSERT INTO links_archive "
+                "(short_code, original_url, title, click_count, created_at, expires_at, max_clicks) "
+                "SELECT short_code, original_url, title, click_count, created_at, expires_at, max_clicks "
+                f"FROM links WHERE short_code IN ({placeholders})",
+                tuple(codes)
+            )
+        cursor.execute(f"DELETE FROM clicks WHERE short_code IN ({placeholders})", tuple(codes))
+        cursor.execute(f"DELETE FROM links WHERE short_code IN ({placeholders})", tuple(codes))
+        log_link_changes(cursor, codes, 'delete')
+        return codes
+
+    swept = 0
+    for shard in range(db.shard_count):
+        while True:
+            codes = db.execute_transaction(sweep_batch, shard, 'TRANSACTION: DELETE FROM links')
+            if not codes:
+                break
+
+            for code in codes:
+                db.invalidate_link(code)
+            try:
+                db.sketches.delete_many(codes)
+            except Exception as e:
+                app.logger.warning(f'Failed to delete sketches for expired links: {e}')
+
+            swept += len(codes)
+            if len(codes) < batch_size:
+                break
+
+    if swept:
+        app.logger.info(f'Swept {swept} expired links (mode={mode})')
+    return swept
+
+def start_expiry_sweeper():
+    """启动后台过期清理线程；各工作进程通过第一个分片上的MySQL命名锁保证同一时间只有一个在执行"""
+    if SWEEP_INTERVAL <= 0:
+        return
+
+    def worker():
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                db = get_db_manager()
+                # 命名锁绑定在连接上，清理期间一直持有；进程崩溃时随连接断开自动释放
+                conn = db.get_connection(0)
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (SWEEP_LOCK_NAME,))
+                    if not cursor.fetchall()[0]['acquired']:
+                        continue
+                    try:
+                        sweep_expired_links(db)
+                    finally:
+                        cursor.execute("SELECT RELEASE_LOCK(%s)", (SWEEP_LOCK_NAME,))
+                finally:
+                    db.return_connection(conn)
+            except DatabaseUnavailable:
+                pass
+            except Exception as e:
+                if not is_connection_error(e):
+                    app.logger.error(f'Expiry sweep failed: {e}')
+
+    threading.Thread(target=worker, daemon=True, name='expiry-sweeper').start()
+
+@app.cli.command('sweep-expired-links')
+@click.option('--batch-size', default=SWEEP_BATCH_SIZE, show_default=True, help='每批处理的链接数')
+@click.option('--mode', type=click.Choice(['delete', 'archive']), default=SWEEP_MODE, show_default=True,
+              help='过期链接直接删除或移入links_archive')
+def sweep_expired_links_command(batch_size, mode):
+    """立即清理已过期的链接"""
+    swept = sweep_expired_links(get_db_manager(), batch_size=batch_size, mode=mode)
+    click.echo(f'Swept {swept} expired links')
+
+@maintenance_task
+def compact_click_segments(db, keep=False, batch_size=1000):
+    """把已封存的点击分段批量导入MySQL：写入clicks并累加click_count
+
+    已删除链接的点击会被丢弃。同一时间只允许一个导入任务（目录下compact.lock文件锁），
+    分段先改名为*.importing认领再导入，每批导入后记录进度；中断后下次运行从记录的位置继续，
+    最多重复导入一批。导入完成后删除分段（keep时改名为*.done保留）。
+    返回导入的点击数，其他导入任务正在运行时返回None。
+    """
+    log = db.click_log
+
+    def flush(batch):
+        codes = sorted({r['short_code'] for r in batch})
+        placeholders = ', '.join(['%s'] * len(codes))
+        for shard in range(db.shard_count):
+            existing = {
+                row['short_code'] for row in db.execute_query(
+                    f"SELECT short_code FROM links WHERE short_code IN ({placeholders})",
+                    tuple(codes), fetch=True, shard=shard
+                )
+            }
+            rows = [r for r in batch if r['short_code'] in existing]
+            if not rows:
+                continue
+            counts = {}
+            for r in rows:
+                if not r['flags'] & CLICK_FLAG_COUNTED:
+                    counts[r['short_code']] = counts.get(r['short_code'], 0) + 1
+
+            def load(cursor):
+                cursor.executemany(
+                    "INSERT INTO clicks (short_code, ip_address, user_agent, referer, clicked_at) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(r['short_code'], r['ip_address'], r['user_agent'], r['referer'], r['clicked_at']) for r in rows]
+                )
+                if counts:
+                    cursor.executemany(
+                        "UPDATE links SET click_count = click_count + %s WHERE short_code = %s",
+                        [(count, code) for code, count in counts.items()]
+                    )
+
+            db.execute_transaction(load, shard, 'TRANSACTION: INSERT INTO clicks')
+
+    with open(os.path.join(log.directory, 'compact.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None  # 其他导入任务正在运行
+
+        log.seal_stale_segments()
+        # 认领已封存的分段；上次中断遗留的*.importing一并继续导入
+        for path in log.segments(include_open=False):
+            os.rename(path, path[:-len('.seg')] + '.importing')
+        claimed = sorted(
+            glob.glob(os.path.join(log.directory, '*.importing')),
+            key=lambda p: os.path.basename(p).split('.')[0]
+        )
+
+        loaded = 0
+        for path in claimed:
+            progress_path = path + '.progress'
+            done = 0
+            if os.path.exists(progress_path):
+                with open(progress_path, encoding='utf-8') as f:
+                    done = int(f.read().strip() or 0)
+
+            def save_progress(index):
+                write_atomic(progress_path, lambda f: f.write(str(index).encode('utf-8')))
+
+            batch = []
+            for index, record in enumerate(iter_click_segment(path), 1):
+                if index <= done:
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    save_progress(index)
+                    loaded += len(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+                loaded += len(batch)
+
+            if keep:
+                os.rename(path, path[:-len('.importing')] + '.done')
+            else:
+                os.remove(path)
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+
+    if loaded:
+        app.logger.info(f'Compacted {loaded} clicks from segment log')
+    return loaded
+
+@app.cli.command('compact-click-log')
+@click.option('--keep', is_flag=True, help='导入后保留分段文件（改名为*.done）')
+@click.option('--batch-size', default=1000, show_default=True, help='每批导入的点击数')
+def compact_click_log_command(keep, batch_size):
+    """把已封存的点击分段导入MySQL"""
+    loaded = compact_click_segments(get_db_manager(), keep=keep, batch_size=batch_size)
+    if loaded is None:
+        click.echo('Another compaction is running, skipped')
+        return
+    click.echo(f'Loaded {loaded} clicks into MySQL')
+
 # 初始化数据库
 init_db()
 
 if __name__ == '__main__':
     app.logger.info('Short Link API starting in development mode...')
+    start_expiry_sweeper()
     app.run(host='0.0.0.0', port=2282, debug=False)
@@ -53,3 +53,8 @@ raw_env = [
     f'SHORT_CODE_LENGTH={os.getenv("SHORT_CODE_LENGTH", "6")}',
     f'LOG_LEVEL={os.getenv("LOG_LEVEL", "INFO")}',
 ]
+
+# 工作进程初始化完成后启动后台过期清理（preload_app时不能在主进程中启动线程）
+def post_worker_init(worker):
+    from app import start_expiry_sweeper
+    start_expiry_sweeper()